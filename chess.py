@@ -20,10 +20,20 @@ move = [ leaving_position, arriving_position ]
 
 '''
 
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
-from random import choice
+from os import path
+from random import choice, Random
 from time import sleep, time
 
+try:  # optional: compiles the board scans of the move generator
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+    njit = None
+
 COLOR_MASK = 1 << 3
 WHITE = 0 << 3
 BLACK = 1 << 3
@@ -53,6 +63,21 @@ CASTLE_QUEENSIDE_BLACK = 0b1 << 3
 
 FULL_CASTLING_RIGHTS = CASTLE_KINGSIDE_WHITE|CASTLE_QUEENSIDE_WHITE|CASTLE_KINGSIDE_BLACK|CASTLE_QUEENSIDE_BLACK
 
+# castling rights lost when a piece leaves or is captured on one of these squares
+CASTLING_RIGHTS_LOST = { 0:  CASTLE_QUEENSIDE_WHITE,
+                         7:  CASTLE_KINGSIDE_WHITE,
+                         56: CASTLE_QUEENSIDE_BLACK,
+                         63: CASTLE_KINGSIDE_BLACK }
+
+KING_CASTLING_RIGHTS = { WHITE|KING: CASTLE_KINGSIDE_WHITE|CASTLE_QUEENSIDE_WHITE,
+                         BLACK|KING: CASTLE_KINGSIDE_BLACK|CASTLE_QUEENSIDE_BLACK }
+
+# (king, leaving index, arriving index) -> (rook leaving index, rook arriving index)
+CASTLING_ROOK_MOVES = { (WHITE|KING, 4, 6):   (7, 5),
+                        (WHITE|KING, 4, 2):   (0, 3),
+                        (BLACK|KING, 60, 62): (63, 61),
+                        (BLACK|KING, 60, 58): (56, 59) }
+
 ALL_SQUARES    = 0xFFFFFFFFFFFFFFFF
 FILE_A         = 0x0101010101010101
 FILE_B         = 0x0202020202020202
@@ -78,16 +103,17 @@ DARK_SQUARES   = 0xAA55AA55AA55AA55
 FILE_MASKS = [FILE_A, FILE_B, FILE_C, FILE_D, FILE_E, FILE_F, FILE_G, FILE_H]
 RANK_MASKS = [RANK_1, RANK_2, RANK_3, RANK_4, RANK_5, RANK_6, RANK_7, RANK_8]
 
-INITIAL_BOARD = [ WHITE|ROOK, WHITE|KNIGHT, WHITE|BISHOP, WHITE|QUEEN, WHITE|KING, WHITE|BISHOP, WHITE|KNIGHT, WHITE|ROOK,
-                  WHITE|PAWN, WHITE|PAWN,   WHITE|PAWN,   WHITE|PAWN,  WHITE|PAWN, WHITE|PAWN,   WHITE|PAWN,   WHITE|PAWN, 
-                  EMPTY,      EMPTY,        EMPTY,        EMPTY,       EMPTY,      EMPTY,        EMPTY,        EMPTY,
-                  EMPTY,      EMPTY,        EMPTY,        EMPTY,       EMPTY,      EMPTY,        EMPTY,        EMPTY,
-                  EMPTY,      EMPTY,        EMPTY,        EMPTY,       EMPTY,      EMPTY,        EMPTY,        EMPTY,
-                  EMPTY,      EMPTY,        EMPTY,        EMPTY,       EMPTY,      EMPTY,        EMPTY,        EMPTY,
-                  BLACK|PAWN, BLACK|PAWN,   BLACK|PAWN,   BLACK|PAWN,  BLACK|PAWN, BLACK|PAWN,   BLACK|PAWN,   BLACK|PAWN,
-                  BLACK|ROOK, BLACK|KNIGHT, BLACK|BISHOP, BLACK|QUEEN, BLACK|KING, BLACK|BISHOP, BLACK|KNIGHT, BLACK|ROOK ]
+# boards are bytearrays: piece codes fit in a byte and indexing returns a plain int
+INITIAL_BOARD = bytearray([ WHITE|ROOK, WHITE|KNIGHT, WHITE|BISHOP, WHITE|QUEEN, WHITE|KING, WHITE|BISHOP, WHITE|KNIGHT, WHITE|ROOK,
+                            WHITE|PAWN, WHITE|PAWN,   WHITE|PAWN,   WHITE|PAWN,  WHITE|PAWN, WHITE|PAWN,   WHITE|PAWN,   WHITE|PAWN, 
+                            EMPTY,      EMPTY,        EMPTY,        EMPTY,       EMPTY,      EMPTY,        EMPTY,        EMPTY,
+                            EMPTY,      EMPTY,        EMPTY,        EMPTY,       EMPTY,      EMPTY,        EMPTY,        EMPTY,
+                            EMPTY,      EMPTY,        EMPTY,        EMPTY,       EMPTY,      EMPTY,        EMPTY,        EMPTY,
+                            EMPTY,      EMPTY,        EMPTY,        EMPTY,       EMPTY,      EMPTY,        EMPTY,        EMPTY,
+                            BLACK|PAWN, BLACK|PAWN,   BLACK|PAWN,   BLACK|PAWN,  BLACK|PAWN, BLACK|PAWN,   BLACK|PAWN,   BLACK|PAWN,
+                            BLACK|ROOK, BLACK|KNIGHT, BLACK|BISHOP, BLACK|QUEEN, BLACK|KING, BLACK|BISHOP, BLACK|KNIGHT, BLACK|ROOK ])
 
-EMPTY_BOARD = [ EMPTY for _ in range(64) ]
+EMPTY_BOARD = bytearray(64)
 
 INITIAL_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
 STROKES_YOLO = '1k6/2b1p3/Qp4N1/4r2P/2B2q2/1R6/2Pn2K1/8 w - - 0 1'
@@ -162,13 +188,81 @@ KING_ENDGAME_BONUS = [ 0,  10,  20,  30,  30,  20,  10,   0,
                       10,  20,  30,  40,  40,  30,  20,  10,
                        0,  10,  20,  30,  30,  20,  10,   0]
 
+NO_BONUS = [ 0 for _ in range(64) ]
+
+BONUS_TABLES_WHITE = { PAWN:   PAWN_BONUS,
+                       KNIGHT: KNIGHT_BONUS,
+                       BISHOP: BISHOP_BONUS,
+                       ROOK:   NO_BONUS,
+                       QUEEN:  NO_BONUS,
+                       KING:   KING_BONUS,
+                       JOKER:  NO_BONUS }
+ENDGAME_BONUS_TABLES_WHITE = dict(BONUS_TABLES_WHITE)
+ENDGAME_BONUS_TABLES_WHITE[KING] = KING_ENDGAME_BONUS
+
+# black tables are the white ones mirrored vertically (index ^ 56 flips the rank)
+BONUS_TABLES_BLACK = { piece_type: [ table[i ^ 56] for i in range(64) ] for piece_type, table in BONUS_TABLES_WHITE.items() }
+ENDGAME_BONUS_TABLES_BLACK = { piece_type: [ table[i ^ 56] for i in range(64) ] for piece_type, table in ENDGAME_BONUS_TABLES_WHITE.items() }
+
+# material plus positional bonus of a piece on a square from white's point of view, indexed
+# by piece code then square; game.score is the sum over the board, kept incrementally by do_move.
+# The king uses its middlegame table here and is corrected at the leaves in the endgame
+def square_score(piece, index):
+    piece_type = piece&PIECE_MASK
+    if piece_type not in PIECE_TYPES:
+        return 0
+    if piece&COLOR_MASK == WHITE:
+        return PIECE_VALUES[piece_type] + BONUS_TABLES_WHITE[piece_type][index]
+    return -PIECE_VALUES[piece_type] - BONUS_TABLES_BLACK[piece_type][index]
+
+SCORE_TABLE = [ [ square_score(piece, i) for i in range(64) ] for piece in range(16) ]
+
+if np is not None:
+    SCORE_TABLE_ARRAY = np.array(SCORE_TABLE, dtype=np.int32)
+    SQUARE_INDICES = np.arange(64)
+
+KING_ENDGAME_ADJUSTMENT = { WHITE: [ ENDGAME_BONUS_TABLES_WHITE[KING][i] - BONUS_TABLES_WHITE[KING][i] for i in range(64) ],
+                            BLACK: [ ENDGAME_BONUS_TABLES_BLACK[KING][i] - BONUS_TABLES_BLACK[KING][i] for i in range(64) ] }
+
+ZOBRIST_SEED = 20160812
+zobrist_random = Random(ZOBRIST_SEED)
+
+ZOBRIST = [ [ 0 if piece == EMPTY else zobrist_random.getrandbits(64) for _ in range(64) ] for piece in range(16) ]
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [ zobrist_random.getrandbits(64) for _ in range(16) ]
+ZOBRIST_EP = { 0: 0 }
+ZOBRIST_EP.update({ 0b1 << i: zobrist_random.getrandbits(64) for i in range(64) })
+
+TT_EXACT = 0
+TT_LOWER = 1
+TT_UPPER = 2
+TT_MAX_ENTRIES = 200000
+HALFMOVE_CLOCK_LIMIT = 150  # 75 moves
+LEGAL_MOVES_CACHE_MAX_ENTRIES = 100000
+
+MATE_SCORE = 10 * PIECE_VALUES[KING]
+OPP = { WHITE: BLACK, BLACK: WHITE }
+SIGN = { WHITE: 1, BLACK: -1 }  # turns white's score into the score of the side to move
+WIN_SCORE_OPP = { WHITE: MATE_SCORE, BLACK: -MATE_SCORE }  # score of color mating its opponent
+
+MAX_PLY = 64
+TT_MOVE_ORDER      = 1 << 30
+CAPTURE_MOVE_ORDER = 1 << 28
+KILLER_MOVE_ORDER  = 1 << 26
+QUIESCENCE_DELTA_MARGIN = 200
+QUIESCENCE_MAX_PLY = 4
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+LMR_MIN_DEPTH = 3
+LMR_FULL_DEPTH_MOVES = 4
+
 verbose = False
 
 # ================= CHESS GAME =============================
 
 class Game:
     def __init__(self, FEN=''):
-        self.board = INITIAL_BOARD
+        self.board = INITIAL_BOARD[:]
         self.to_move = WHITE
         self.ep_square = 0
         self.castling_rights = FULL_CASTLING_RIGHTS
@@ -183,6 +277,20 @@ class Game:
             self.position_history.append(INITIAL_FEN)
             
         self.move_history = []
+        self.reset_incremental_state()
+    
+    # state kept up to date by do_move/undo_move, recomputed here after direct board edits
+    def reset_incremental_state(self):
+        self.zobrist = zobrist_hash(self)
+        self.white_pieces_bb = get_colored_pieces(self.board, WHITE)
+        self.black_pieces_bb = get_colored_pieces(self.board, BLACK)
+        self.white_rooks_bb = get_rooks(self.board, WHITE)
+        self.black_rooks_bb = get_rooks(self.board, BLACK)
+        self.white_pawns_bb = get_pawns(self.board, WHITE)
+        self.black_pawns_bb = get_pawns(self.board, BLACK)
+        self.mat_w = material_sum(self.board, WHITE)
+        self.mat_b = material_sum(self.board, BLACK)
+        self.score = board_score(self.board)
     
     def get_move_list(self):
         return ' '.join(self.move_history)
@@ -239,7 +347,7 @@ class Game:
         board_str = FEN_list[0]
         rank_list = board_str.split('/')
         rank_list.reverse()
-        self.board = []
+        self.board = bytearray()
         
         for rank in rank_list:
             rank_pieces = []
@@ -381,10 +489,32 @@ def msb(bitboard):
         if bit & bitboard:
             return bit
 
+if njit is not None:
+    @njit(cache=True)
+    def colored_pieces_kernel(board, color):
+        bitboard = np.uint64(0)
+        for index in range(64):
+            piece = board[index]
+            if piece != EMPTY and piece & COLOR_MASK == color:
+                bitboard |= np.uint64(1) << np.uint64(index)
+        return bitboard
+
+    @njit(cache=True)
+    def empty_squares_kernel(board):
+        bitboard = np.uint64(0)
+        for index in range(64):
+            if board[index] == EMPTY:
+                bitboard |= np.uint64(1) << np.uint64(index)
+        return bitboard
+
 def get_colored_pieces(board, color):
+    if njit is not None:
+        return int(colored_pieces_kernel(np.frombuffer(board, dtype=np.uint8), color))
     return list2int([ (i != EMPTY and i&COLOR_MASK == color) for i in board ])
 
 def empty_squares(board):
+    if njit is not None:
+        return int(empty_squares_kernel(np.frombuffer(board, dtype=np.uint8)))
     return list2int([ i == EMPTY for i in board ])
 
 def occupied_squares(board):
@@ -413,7 +543,7 @@ def flip_board_v(board):
              8,   9,  10,  11,  12,  13,  14,  15,
              0,   1,   2,   3,   4,   5,   6,   7]
     
-    return deepcopy([board[flip[i]] for i in range(64)])
+    return bytearray([board[flip[i]] for i in range(64)])
 
 def east_one(bitboard):
     return (bitboard << 1) & nnot(FILE_A)
@@ -447,70 +577,145 @@ def move_piece(board, move):
 
 def make_move(game, move):
     new_game = deepcopy(game)
-    leaving_position = move[0]
-    arriving_position = move[1]
+    do_move(new_game, move)
+    
+    # update history
+    new_game.move_history.append(move2str(move))
+    new_game.position_history.append(new_game.to_FEN())
+    return new_game
+
+def do_move(game, move):
+    board = game.board
+    leaving_index = move[0].bit_length() - 1
+    arriving_index = move[1].bit_length() - 1
+    moving_piece = board[leaving_index]
+    placed_piece = moving_piece
+    captured_index = arriving_index
+    captured_piece = board[arriving_index]
+    rook_move = None
+    previous_state = (game.castling_rights, game.ep_square, game.halfmove_clock, game.fullmove_number, game.zobrist,
+                      game.white_pieces_bb, game.black_pieces_bb, game.white_rooks_bb, game.black_rooks_bb,
+                      game.white_pawns_bb, game.black_pawns_bb, game.mat_w, game.mat_b, game.score)
+    zobrist = game.zobrist ^ ZOBRIST_CASTLING[game.castling_rights] ^ ZOBRIST_EP[game.ep_square]
     
     # update_clocks
-    new_game.halfmove_clock += 1
-    if new_game.to_move == BLACK:
-        new_game.fullmove_number += 1
+    game.halfmove_clock += 1
+    if game.to_move == BLACK:
+        game.fullmove_number += 1
     
     # reset clock if capture
-    if get_piece(new_game.board, arriving_position) != EMPTY:
-        new_game.halfmove_clock = 0
+    if captured_piece != EMPTY:
+        game.halfmove_clock = 0
     
     # for pawns: reset clock, removed captured ep, set new ep, promote
-    if get_piece(new_game.board, leaving_position)&PIECE_MASK == PAWN:
-        new_game.halfmove_clock = 0
+    ep_square = 0
+    if moving_piece&PIECE_MASK == PAWN:
+        game.halfmove_clock = 0
         
-        if arriving_position == game.ep_square:
-            new_game.board = remove_captured_ep(new_game)
+        if move[1] == game.ep_square:
+            if game.ep_square & RANK_3:
+                captured_index = arriving_index + 8
+            if game.ep_square & RANK_6:
+                captured_index = arriving_index - 8
+            captured_piece = board[captured_index]
+            board[captured_index] = EMPTY
     
-        if is_double_push(leaving_position, arriving_position):
-            new_game.ep_square = new_ep_square(leaving_position)
+        if is_double_push(move[0], move[1]):
+            ep_square = new_ep_square(move[0])
             
-        if arriving_position&(RANK_1|RANK_8):
-            new_game.board[bb2index(leaving_position)] = new_game.to_move|QUEEN
+        if move[1]&(RANK_1|RANK_8):
+            placed_piece = game.to_move|QUEEN
+    game.ep_square = ep_square
     
-    # reset ep square if not updated
-    if new_game.ep_square == game.ep_square:
-        new_game.ep_square = 0
-        
-    # update castling rights for rook moves
-    if leaving_position == str2bb('a1'):
-        new_game.castling_rights = remove_castling_rights(new_game, CASTLE_QUEENSIDE_WHITE)
-    if leaving_position == str2bb('h1'):
-        new_game.castling_rights = remove_castling_rights(new_game, CASTLE_KINGSIDE_WHITE)
-    if leaving_position == str2bb('a8'):
-        new_game.castling_rights = remove_castling_rights(new_game, CASTLE_QUEENSIDE_BLACK)
-    if leaving_position == str2bb('h8'):
-        new_game.castling_rights = remove_castling_rights(new_game, CASTLE_KINGSIDE_BLACK)
+    # update castling rights for rook and king moves, castle
+    game.castling_rights &= ~CASTLING_RIGHTS_LOST.get(leaving_index, 0) & ~CASTLING_RIGHTS_LOST.get(arriving_index, 0)
+    if moving_piece&PIECE_MASK == KING:
+        game.castling_rights &= ~KING_CASTLING_RIGHTS[moving_piece]
+        rook_move = CASTLING_ROOK_MOVES.get((moving_piece, leaving_index, arriving_index))
+        if rook_move:
+            rook = board[rook_move[0]]
+            board[rook_move[1]] = rook
+            board[rook_move[0]] = EMPTY
+            zobrist ^= ZOBRIST[rook][rook_move[0]] ^ ZOBRIST[rook][rook_move[1]]
     
-    # castling
-    if get_piece(new_game.board, leaving_position) == WHITE|KING:
-        new_game.castling_rights = remove_castling_rights(new_game, CASTLE_KINGSIDE_WHITE|CASTLE_QUEENSIDE_WHITE)
-        if leaving_position == str2bb('e1'):
-            if arriving_position == str2bb('g1'):
-                new_game.board = move_piece(new_game.board, [str2bb('h1'), str2bb('f1')])
-            if arriving_position == str2bb('c1'):
-                new_game.board = move_piece(new_game.board, [str2bb('a1'), str2bb('d1')])
-        
-    if get_piece(new_game.board, leaving_position) == BLACK|KING:
-        new_game.castling_rights = remove_castling_rights(new_game, CASTLE_KINGSIDE_BLACK|CASTLE_QUEENSIDE_BLACK)
-        if leaving_position == str2bb('e8'):
-            if arriving_position == str2bb('g8'):
-                new_game.board = move_piece(new_game.board, [str2bb('h8'), str2bb('f8')])
-            if arriving_position == str2bb('c8'):
-                new_game.board = move_piece(new_game.board, [str2bb('a8'), str2bb('d8')])
+    # update positions, occupancy, material, positional bonus and next to move
+    board[arriving_index] = placed_piece
+    board[leaving_index] = EMPTY
+    moved_squares = move[0] | move[1]
+    moved_rooks = moved_squares if moving_piece&PIECE_MASK == ROOK else 0
+    moved_pawns = 0
+    if moving_piece&PIECE_MASK == PAWN:
+        moved_pawns = moved_squares if placed_piece == moving_piece else move[0]
+    captured_square = 0b1 << captured_index
+    material_change = PIECE_VALUES[placed_piece&PIECE_MASK] - PIECE_VALUES[moving_piece&PIECE_MASK]
+    captured_material = PIECE_VALUES[captured_piece&PIECE_MASK]
+    game.score += SCORE_TABLE[placed_piece][arriving_index] - SCORE_TABLE[moving_piece][leaving_index] - \
+                  SCORE_TABLE[captured_piece][captured_index]
+    if rook_move:
+        moved_rooks = (0b1 << rook_move[0]) | (0b1 << rook_move[1])
+        moved_squares |= moved_rooks
+        game.score += SCORE_TABLE[rook][rook_move[1]] - SCORE_TABLE[rook][rook_move[0]]
+    if game.to_move == WHITE:
+        game.white_pieces_bb ^= moved_squares
+        game.black_pieces_bb &= ~captured_square
+        game.white_rooks_bb ^= moved_rooks
+        game.black_rooks_bb &= ~captured_square
+        game.white_pawns_bb ^= moved_pawns
+        game.black_pawns_bb &= ~captured_square
+        game.mat_w += material_change
+        game.mat_b -= captured_material
+    elif game.to_move == BLACK:
+        game.black_pieces_bb ^= moved_squares
+        game.white_pieces_bb &= ~captured_square
+        game.black_rooks_bb ^= moved_rooks
+        game.white_rooks_bb &= ~captured_square
+        game.black_pawns_bb ^= moved_pawns
+        game.white_pawns_bb &= ~captured_square
+        game.mat_b += material_change
+        game.mat_w -= captured_material
+    game.to_move = OPP[game.to_move]
     
-    # update positions and next to move
-    new_game.board = move_piece(new_game.board, (leaving_position, arriving_position))
-    new_game.to_move = opposing_color(new_game.to_move)
+    zobrist ^= ZOBRIST[moving_piece][leaving_index] ^ ZOBRIST[placed_piece][arriving_index]
+    zobrist ^= ZOBRIST[captured_piece][captured_index] ^ ZOBRIST_BLACK_TO_MOVE
+    game.zobrist = zobrist ^ ZOBRIST_CASTLING[game.castling_rights] ^ ZOBRIST_EP[game.ep_square]
+    return (move, moving_piece, captured_piece, captured_index, rook_move) + previous_state
+
+def undo_move(game, undo_info):
+    (move, moving_piece, captured_piece, captured_index, rook_move,
+     game.castling_rights, game.ep_square, game.halfmove_clock, game.fullmove_number, game.zobrist,
+     game.white_pieces_bb, game.black_pieces_bb, game.white_rooks_bb, game.black_rooks_bb,
+     game.white_pawns_bb, game.black_pawns_bb, game.mat_w, game.mat_b, game.score) = undo_info
+    board = game.board
     
-    # update history
-    new_game.move_history.append(move2str(move))
-    new_game.position_history.append(new_game.to_FEN())
-    return new_game
+    board[move[1].bit_length() - 1] = EMPTY
+    board[captured_index] = captured_piece
+    board[move[0].bit_length() - 1] = moving_piece
+    if rook_move:
+        board[rook_move[0]] = board[rook_move[1]]
+        board[rook_move[1]] = EMPTY
+    game.to_move = OPP[game.to_move]
+
+# passes the turn, for null move pruning
+def do_null_move(game):
+    undo_info = (game.ep_square, game.zobrist)
+    game.zobrist ^= ZOBRIST_EP[game.ep_square] ^ ZOBRIST_EP[0] ^ ZOBRIST_BLACK_TO_MOVE
+    game.ep_square = 0
+    game.to_move = OPP[game.to_move]
+    return undo_info
+
+def undo_null_move(game, undo_info):
+    (game.ep_square, game.zobrist) = undo_info
+    game.to_move = OPP[game.to_move]
+
+def zobrist_hash(game):
+    h = 0
+    for index in range(64):
+        h ^= ZOBRIST[game.board[index]][index]
+    if game.to_move == BLACK:
+        h ^= ZOBRIST_BLACK_TO_MOVE
+    h ^= ZOBRIST_CASTLING[game.castling_rights]
+    h ^= ZOBRIST_EP[game.ep_square]
+    return h
 
 def unmake_move(game):
     if len(game.position_history) < 2:
@@ -685,6 +890,7 @@ def king_attacks(moving_piece):
 def can_castle_kingside(game, color):
     if color == WHITE:
         return (game.castling_rights & CASTLE_KINGSIDE_WHITE) and \
+                game.board[str2index('h1')] == WHITE|ROOK and \
                 game.board[str2index('f1')] == EMPTY and \
                 game.board[str2index('g1')] == EMPTY and \
                 (not is_attacked(str2bb('e1'), game.board, opposing_color(color))) and \
@@ -692,6 +898,7 @@ def can_castle_kingside(game, color):
                 (not is_attacked(str2bb('g1'), game.board, opposing_color(color)))
     if color == BLACK:
         return (game.castling_rights & CASTLE_KINGSIDE_BLACK) and \
+                game.board[str2index('h8')] == BLACK|ROOK and \
                 game.board[str2index('f8')] == EMPTY and \
                 game.board[str2index('g8')] == EMPTY and \
                 (not is_attacked(str2bb('e8'), game.board, opposing_color(color))) and \
@@ -701,6 +908,7 @@ def can_castle_kingside(game, color):
 def can_castle_queenside(game, color):
     if color == WHITE:
         return (game.castling_rights & CASTLE_QUEENSIDE_WHITE) and \
+                game.board[str2index('a1')] == WHITE|ROOK and \
                 game.board[str2index('b1')] == EMPTY and \
                 game.board[str2index('c1')] == EMPTY and \
                 game.board[str2index('d1')] == EMPTY and \
@@ -709,6 +917,7 @@ def can_castle_queenside(game, color):
                 (not is_attacked(str2bb('e1'), game.board, opposing_color(color)))
     if color == BLACK:
         return (game.castling_rights & CASTLE_QUEENSIDE_BLACK) and \
+                game.board[str2index('a8')] == BLACK|ROOK and \
                 game.board[str2index('b8')] == EMPTY and \
                 game.board[str2index('c8')] == EMPTY and \
                 game.board[str2index('d8')] == EMPTY and \
@@ -921,7 +1130,12 @@ def joker_moves(moving_piece, board, color):
 # ===========================
 
 def is_attacked(target, board, attacking_color):
-    return count_attacks(target, board, attacking_color) > 0
+    for index in range(64):
+        piece = board[index]
+        if piece != EMPTY and piece&COLOR_MASK == attacking_color:
+            if get_attacks(0b1 << index, board, attacking_color) & target:
+                return True
+    return False
 
 def is_check(board, color):
     return is_attacked(get_king(board, color), board, opposing_color(color))
@@ -1017,6 +1231,19 @@ def legal_moves(game, color):
             yield move
     return
 
+# legal moves of positions already seen, keyed by zobrist hash
+legal_moves_cache = {}
+
+def cached_legal_moves(game, color):
+    key = (game.zobrist, color)
+    moves = legal_moves_cache.get(key)
+    if moves is None:
+        moves = tuple(legal_moves(game, color))
+        if len(legal_moves_cache) >= LEGAL_MOVES_CACHE_MAX_ENTRIES:
+            del legal_moves_cache[next(iter(legal_moves_cache))]
+        legal_moves_cache[key] = moves
+    return moves
+
 def legal_moves_rdm(game, color):
     lm = []
     for move in pseudo_legal_moves(game, color):
@@ -1025,8 +1252,11 @@ def legal_moves_rdm(game, color):
     return lm
 
 def is_legal_move(game, move):
-    new_game = make_move(game, move)
-    return not is_check(new_game.board, game.to_move)
+    color = game.to_move
+    undo_info = do_move(game, move)
+    legal = not is_check(game.board, color)
+    undo_move(game, undo_info)
+    return legal
     
 def count_legal_moves(game, color):
     move_count = 0
@@ -1064,7 +1294,7 @@ def is_under_50_move_rule(game):
     return game.halfmove_clock >= 100
 
 def is_under_75_move_rule(game):
-    return game.halfmove_clock >= 150
+    return game.halfmove_clock >= HALFMOVE_CLOCK_LIMIT
 
 def material_sum(board, color):
     material = 0
@@ -1073,15 +1303,20 @@ def material_sum(board, color):
             material += PIECE_VALUES[piece&PIECE_MASK]
     return material
 
+def board_score(board):
+    if np is not None:  # a single gather over the 64 squares
+        return int(SCORE_TABLE_ARRAY[np.frombuffer(board, dtype=np.uint8), SQUARE_INDICES].sum())
+    return sum([ SCORE_TABLE[board[index]][index] for index in range(64) ])
+
 def has_insufficient_material(game): # TODO: other insufficient positions
-    if material_sum(game.board, WHITE) + material_sum(game.board, BLACK) == 2*PIECE_VALUES[KING]:
+    if game.mat_w + game.mat_b == 2*PIECE_VALUES[KING]:
         return True
-    if material_sum(game.board, WHITE) == PIECE_VALUES[KING]:
-        if material_sum(game.board, BLACK) == PIECE_VALUES[KING] + PIECE_VALUES[KNIGHT] and \
+    if game.mat_w == PIECE_VALUES[KING]:
+        if game.mat_b == PIECE_VALUES[KING] + PIECE_VALUES[KNIGHT] and \
         (get_knights(game.board, BLACK) != 0 or get_bishops(game.board, BLACK) != 0):
             return True
-    if material_sum(game.board, BLACK) == PIECE_VALUES[KING]:
-        if material_sum(game.board, WHITE) == PIECE_VALUES[KING] + PIECE_VALUES[KNIGHT] and \
+    if game.mat_b == PIECE_VALUES[KING]:
+        if game.mat_w == PIECE_VALUES[KING] + PIECE_VALUES[KNIGHT] and \
         (get_knights(game.board, WHITE) != 0 or get_bishops(game.board, WHITE) != 0):
             return True
     return False
@@ -1225,47 +1460,38 @@ def mobility_balance(game):
     return count_legal_moves(game, WHITE) - count_legal_moves(game, BLACK)
 
 
-def positional_balance(game):
-    return positional_bonus(game, WHITE) - positional_bonus(game, BLACK)
-
-
-def positional_bonus(game, color):
+# the rook file and rank bonuses and the endgame king table, which game.score
+# (kept incrementally by do_move) leaves out
+def rook_and_king_bonus(game, color):
     bonus = 0
+    board = game.board
 
     if color == WHITE:
-        board = game.board
+        rooks = game.white_rooks_bb
+        own_pawns = game.white_pawns_bb
+        seventh_rank = 6
     elif color == BLACK:
-        board = flip_board_v(game.board)
-
-    for index in range(64):
-        piece = board[index]
-
-        if piece != EMPTY and piece & COLOR_MASK == color:
-            piece_type = piece & PIECE_MASK
+        rooks = game.black_rooks_bb
+        own_pawns = game.black_pawns_bb
+        seventh_rank = 1
+    all_pawns = game.white_pawns_bb | game.black_pawns_bb
 
-            if piece_type == PAWN:
-                bonus += PAWN_BONUS[index]
-            elif piece_type == KNIGHT:
-                bonus += KNIGHT_BONUS[index]
-            elif piece_type == BISHOP:
-                bonus += BISHOP_BONUS[index]
+    if count_pieces(game.white_pieces_bb | game.black_pieces_bb) <= ENDGAME_PIECE_COUNT:
+        bonus += KING_ENDGAME_ADJUSTMENT[color][board.index(color|KING)]
 
-            elif piece_type == ROOK:
-                position = 0b1 << index
+    while rooks:
+        index = (rooks & -rooks).bit_length() - 1
+        rook_file = FILE_MASKS[index & 7]
 
-                if is_open_file(position, board):
-                    bonus += ROOK_OPEN_FILE_BONUS
-                elif is_semi_open_file(position, board):
-                    bonus += ROOK_SEMI_OPEN_FILE_BONUS
+        if not all_pawns & rook_file:
+            bonus += ROOK_OPEN_FILE_BONUS
+        elif not own_pawns & rook_file:
+            bonus += ROOK_SEMI_OPEN_FILE_BONUS
 
-                if position & RANK_7:
-                    bonus += ROOK_ON_SEVENTH_BONUS
+        if index >> 3 == seventh_rank:
+            bonus += ROOK_ON_SEVENTH_BONUS
 
-            elif piece_type == KING:
-                if is_endgame(board):
-                    bonus += KING_ENDGAME_BONUS[index]
-                else:
-                    bonus += KING_BONUS[index]
+        rooks &= rooks - 1
 
     return bonus
 
@@ -1274,7 +1500,12 @@ def evaluate_game(game):
     if game_ended(game):
         return evaluate_end_node(game)
     else:
-        return material_balance(game.board) + positional_balance(game)  # + 10*mobility_balance(game)
+        return evaluate_position(game)
+
+
+def evaluate_position(game):
+    return game.score + \
+           rook_and_king_bonus(game, WHITE) - rook_and_king_bonus(game, BLACK)  # + 10*mobility_balance(game)
 
 
 def evaluate_end_node(game):
@@ -1293,149 +1524,474 @@ def win_score(color):
         return 10 * PIECE_VALUES[KING]
 
 
-def evaluated_move(game, color):
+def evaluated_move(game, color, root=False):
     best_score = win_score(color)
+    best_move = None
     best_moves = []
 
-    for move in legal_moves(game, color):
-        evaluation = evaluate_game(make_move(game, move))
+    for move in cached_legal_moves(game, color):
+        undo_info = do_move(game, move)
+        evaluation = evaluate_game(game)
+        checkmate = is_checkmate(game, game.to_move)
+        undo_move(game, undo_info)
 
-        if is_checkmate(make_move(game, move), opposing_color(game.to_move)):
+        if checkmate:
             return [move, evaluation]
 
-        if (color == WHITE and evaluation > best_score) or \
+        if best_move is None or \
+                (color == WHITE and evaluation > best_score) or \
                 (color == BLACK and evaluation < best_score):
             best_score = evaluation
+            best_move = move
             best_moves = [move]
-        elif evaluation == best_score:
+        elif root and evaluation == best_score:
             best_moves.append(move)
 
-    return [choice(best_moves), best_score]
+    if root:  # break ties randomly at the root only
+        best_move = choice(best_moves)
+    return [best_move, best_score]
 
 
 def random_move(game, color):
     return choice(legal_moves_rdm(game, color))
 
-def minimax(game, color, depth=1):
+def minimax(game, color, depth=1, root=False):
     if game_ended(game):
         return [None, evaluate_game(game)]
 
-    [simple_move, simple_evaluation] = evaluated_move(game, color)
+    [simple_move, simple_evaluation] = evaluated_move(game, color, root)
 
     if depth == 1 or \
-            simple_evaluation == win_score(opposing_color(color)):
+            simple_evaluation == WIN_SCORE_OPP[color]:
         return [simple_move, simple_evaluation]
 
     best_score = win_score(color)
+    best_move = None
     best_moves = []
 
-    for move in legal_moves(game, color):
-        his_game = make_move(game, move)
+    for move in cached_legal_moves(game, color):
+        undo_info = do_move(game, move)
 
-        if is_checkmate(his_game, his_game.to_move):
-            return [move, win_score(his_game.to_move)]
+        if is_checkmate(game, game.to_move):
+            undo_move(game, undo_info)
+            return [move, WIN_SCORE_OPP[color]]
 
-        [_, evaluation] = minimax(his_game, opposing_color(color), depth - 1)
+        [_, evaluation] = minimax(game, opposing_color(color), depth - 1)
+        undo_move(game, undo_info)
 
-        if evaluation == win_score(opposing_color(color)):
+        if evaluation == WIN_SCORE_OPP[color]:
             return [move, evaluation]
 
-        if (color == WHITE and evaluation > best_score) or \
+        if best_move is None or \
+                (color == WHITE and evaluation > best_score) or \
                 (color == BLACK and evaluation < best_score):
             best_score = evaluation
+            best_move = move
             best_moves = [move]
-        elif evaluation == best_score:
+        elif root and evaluation == best_score:
             best_moves.append(move)
 
-    return [choice(best_moves), best_score]
-
-
-def alpha_beta(game, color, depth, alpha=-float('inf'), beta=float('inf')):
-    if game_ended(game):
-        return [None, evaluate_game(game)]
-
-    [simple_move, simple_evaluation] = evaluated_move(game, color)
+    if root:
+        best_move = choice(best_moves)
+    return [best_move, best_score]
+
+
+transposition_table = {}
+
+# entries are (depth, value, flag, best_move) tuples
+def probe_tt(key, depth, alpha, beta):
+    entry = transposition_table.get(key)
+    if entry is None or entry[0] < depth:
+        return [entry, None, alpha, beta]
+
+    (_, value, flag, _) = entry
+    if flag == TT_EXACT:
+        return [entry, value, alpha, beta]
+    if flag == TT_LOWER:
+        alpha = max(alpha, value)
+    elif flag == TT_UPPER:
+        beta = min(beta, value)
+
+    if alpha >= beta:
+        return [entry, value, alpha, beta]
+    return [entry, None, alpha, beta]
+
+def store_tt(key, depth, value, flag, best_move):
+    if len(transposition_table) >= TT_MAX_ENTRIES:
+        transposition_table.clear()
+    transposition_table[key] = (depth, value, flag, best_move)
+
+def tt_flag(value, alpha, beta):
+    if value <= alpha:
+        return TT_UPPER
+    if value >= beta:
+        return TT_LOWER
+    return TT_EXACT
+
+# quiet moves that caused a beta cutoff, two per ply, and cutoff counts weighted by depth
+killer_moves = [ [None, None] for _ in range(MAX_PLY) ]
+history_scores = { WHITE: [ [ 0 for _ in range(64) ] for _ in range(64) ],
+                   BLACK: [ [ 0 for _ in range(64) ] for _ in range(64) ] }
+
+def clear_move_ordering():
+    for killers in killer_moves:
+        killers[0] = killers[1] = None
+    for color in history_scores:
+        for scores in history_scores[color]:
+            scores[:] = [ 0 for _ in range(64) ]
+
+def is_capture(game, move):
+    return game.board[move[1].bit_length() - 1] != EMPTY or \
+           (move[1] == game.ep_square and get_piece(game.board, move[0])&PIECE_MASK == PAWN)
+
+def is_promotion(game, move):
+    return move[1]&(RANK_1|RANK_8) and get_piece(game.board, move[0])&PIECE_MASK == PAWN
+
+def has_non_pawn_material(game, color):
+    if color == WHITE:
+        return game.mat_w - PIECE_VALUES[KING] > PIECE_VALUES[PAWN] * count_pieces(game.white_pawns_bb)
+    if color == BLACK:
+        return game.mat_b - PIECE_VALUES[KING] > PIECE_VALUES[PAWN] * count_pieces(game.black_pawns_bb)
+
+def record_cutoff(game, move, color, depth, ply):
+    if is_capture(game, move):
+        return
+    killers = killer_moves[ply]
+    if move != killers[0]:
+        killers[1] = killers[0]
+        killers[0] = move
+    history_scores[color][move[0].bit_length() - 1][move[1].bit_length() - 1] += depth * depth
+
+def captured_value(game, move):
+    victim = game.board[move[1].bit_length() - 1]
+    if victim == EMPTY:  # en passant
+        return PIECE_VALUES[PAWN]
+    return PIECE_VALUES[victim&PIECE_MASK]
+
+# most valuable victim first, least valuable attacker first among equal victims
+def mvv_lva(game, move):
+    attacker = game.board[move[0].bit_length() - 1]
+    return (captured_value(game, move) << 16) - PIECE_VALUES[attacker&PIECE_MASK]
+
+# static scores of the children of game, from white's point of view, computed for
+# all moves at once from the pieces they move and capture instead of making them
+def evaluate_children_batch(game, moves):
+    board = game.board
+    leaving = [ move[0].bit_length() - 1 for move in moves ]
+    arriving = [ move[1].bit_length() - 1 for move in moves ]
+    moving = [ board[index] for index in leaving ]
+    placed = moving[:]
+    captured_index = arriving[:]
+    for i in range(len(moves)):
+        if moving[i]&PIECE_MASK == PAWN:
+            if moves[i][1] == game.ep_square:
+                captured_index[i] += 8 if game.ep_square & RANK_3 else -8
+            elif moves[i][1]&(RANK_1|RANK_8):
+                placed[i] = game.to_move|QUEEN
+    captured = [ board[index] for index in captured_index ]
+
+    if np is not None:
+        scores = (SCORE_TABLE_ARRAY[placed, arriving] - SCORE_TABLE_ARRAY[moving, leaving] -
+                  SCORE_TABLE_ARRAY[captured, captured_index]).tolist()
+    else:
+        scores = [ SCORE_TABLE[placed[i]][arriving[i]] - SCORE_TABLE[moving[i]][leaving[i]] -
+                   SCORE_TABLE[captured[i]][captured_index[i]] for i in range(len(moves)) ]
+
+    for i in range(len(moves)):
+        scores[i] += game.score
+        if moving[i]&PIECE_MASK == KING:
+            rook_move = CASTLING_ROOK_MOVES.get((moving[i], leaving[i], arriving[i]))
+            if rook_move:
+                rook = board[rook_move[0]]
+                scores[i] += SCORE_TABLE[rook][rook_move[1]] - SCORE_TABLE[rook][rook_move[0]]
+    return scores
+
+# hash move first, then captures by MVV-LVA, killer moves and quiet moves by history score
+def move_order(game, move, first_move, color, ply):
+    if move == first_move:
+        return TT_MOVE_ORDER
+    if is_capture(game, move):
+        return CAPTURE_MOVE_ORDER + mvv_lva(game, move)
+    if move in killer_moves[ply]:
+        return KILLER_MOVE_ORDER
+    return history_scores[color][move[0].bit_length() - 1][move[1].bit_length() - 1]
+
+def order_moves(game, moves, first_move, color, ply):
+    moves.sort(key=lambda move: move_order(game, move, first_move, color, ply), reverse=True)
+    return moves
+
+# for nodes next to the horizon, where history has little to say: the hash move,
+# captures and killers come first, and the other quiet moves follow ordered by
+# the static score of their child, only scored once the earlier moves did not cut off
+def staged_moves(game, moves, first_move, color, ply):
+    killers = killer_moves[ply]
+    quiet_moves = []
+    early_moves = []
+    for move in moves:
+        if move == first_move or move in killers or is_capture(game, move):
+            early_moves.append(move)
+        else:
+            quiet_moves.append(move)
+
+    for move in order_moves(game, early_moves, first_move, color, ply):
+        yield move
+    if quiet_moves:
+        sign = SIGN[color]
+        scores = evaluate_children_batch(game, quiet_moves)
+        for _, move in sorted(zip(scores, quiet_moves), key=lambda scored: -sign * scored[0]):
+            yield move
 
-    if depth == 1 or \
-            simple_evaluation == win_score(opposing_color(color)):
-        return [simple_move, simple_evaluation]
 
-    best_moves = []
+# a capture of a defended piece by a more valuable one
+def is_losing_capture(game, move, color):
+    attacker = game.board[move[0].bit_length() - 1]
+    return captured_value(game, move) < PIECE_VALUES[attacker&PIECE_MASK] and \
+           is_attacked(move[1], game.board, opposing_color(color))
 
+# pseudo legal captures, the search checks legality once a capture is not pruned
+def capture_moves(game, color):
     if color == WHITE:
-        for move in legal_moves(game, color):
-            if verbose:
-                print('\t' * depth + str(depth) + '. evaluating ' + PIECE_CODES[
-                    get_piece(game.board, move[0])] + move2str(move))
-
-            new_game = make_move(game, move)
-            [_, score] = alpha_beta(new_game, opposing_color(color), depth - 1, alpha, beta)
+        targets = game.black_pieces_bb
+    else:
+        targets = game.white_pieces_bb
 
-            if verbose:
-                print('\t' * depth + str(depth) + '. ' + str(score) + ' [{},{}]'.format(alpha, beta))
+    for index in range(64):
+        piece = game.board[index]
 
-            if score == win_score(opposing_color(color)):
-                return [move, score]
+        if piece != EMPTY and piece&COLOR_MASK == color:
+            piece_pos = 0b1 << index
+            piece_targets = targets | game.ep_square if piece&PIECE_MASK == PAWN else targets
 
-            if score == alpha:
-                best_moves.append(move)
-            if score > alpha:  # white maximizes her score
-                alpha = score
-                best_moves = [move]
-                if alpha > beta:  # alpha-beta cutoff
-                    if verbose:
-                        print('\t' * depth + 'cutoff')
-                    break
-        if best_moves:
-            return [choice(best_moves), alpha]
-        else:
-            return [None, alpha]
+            for target in single_gen(get_moves(piece_pos, game, color) & piece_targets):
+                yield (piece_pos, target)
 
-    if color == BLACK:
-        for move in legal_moves(game, color):
-            if verbose:
-                print('\t' * depth + str(depth) + '. evaluating ' + PIECE_CODES[
-                    get_piece(game.board, move[0])] + move2str(move))
+# searches captures only until the position is quiet, so that the leaves of
+# alpha_beta are not evaluated in the middle of an exchange. A side in check
+# cannot stand pat and searches all its evasions instead.
+# Results are stored at depth -ply: the fewer plies are left before
+# QUIESCENCE_MAX_PLY, the shallower the entry
+def quiescence(game, alpha, beta, color, ply=0):
+    key = game.zobrist
+    [entry, tt_value, alpha, beta] = probe_tt(key, -ply, alpha, beta)
+    if tt_value is not None:
+        return tt_value
+    alpha_orig = alpha
+    beta_orig = beta
+
+    stand_pat = SIGN[color] * evaluate_position(game)
+    if ply == QUIESCENCE_MAX_PLY:
+        return stand_pat
+    opp = OPP[color]
+
+    in_check = is_check(game.board, color)
+    if in_check:
+        moves = cached_legal_moves(game, color)
+        if not moves:
+            return -MATE_SCORE
+    else:
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        moves = sorted(capture_moves(game, color), key=lambda move: mvv_lva(game, move), reverse=True)
+
+    for move in moves:
+        if not in_check:
+            if stand_pat + captured_value(game, move) + QUIESCENCE_DELTA_MARGIN < alpha:  # delta pruning
+                continue
+            if is_losing_capture(game, move, color) or not is_legal_move(game, move):
+                continue
+        undo_info = do_move(game, move)
+        score = -quiescence(game, -beta, -alpha, opp, ply + 1)
+        undo_move(game, undo_info)
+        if score > alpha:
+            alpha = score
+            if alpha >= beta:
+                break
+
+    # deeper entries, among them those of the main search, are kept
+    if entry is None or entry[0] <= -ply:
+        store_tt(key, -ply, alpha, tt_flag(alpha, alpha_orig, beta_orig), None)
+    return alpha
+
+
+# negamax: scores are from the point of view of the side to move
+def alpha_beta(game, color, depth, alpha=-float('inf'), beta=float('inf'), pv_move=None, root=False, ply=0,
+               null_move=True):
+    if depth == 0:
+        if game_ended(game):
+            return [None, SIGN[color] * evaluate_end_node(game)]
+        return [None, quiescence(game, alpha, beta, color)]
+
+    moves = cached_legal_moves(game, color)
+    if not moves or has_insufficient_material(game) or is_under_75_move_rule(game):
+        return [None, SIGN[color] * evaluate_end_node(game)]
+
+    opp = OPP[color]
+
+    # the zobrist key leaves out the halfmove clock, so nodes that may reach
+    # the 75 move draw within the search are neither probed nor stored
+    key = game.zobrist
+    use_tt = game.halfmove_clock + depth < HALFMOVE_CLOCK_LIMIT
+    [entry, tt_value] = [None, None]
+    if use_tt:
+        [entry, tt_value, alpha, beta] = probe_tt(key, depth, alpha, beta)
+    if tt_value is not None and not root:
+        return [entry[3], tt_value]
+    alpha_orig = alpha
+    beta_orig = beta
+
+    # null move pruning: if passing the turn still fails high, so will a real move
+    in_check = is_check(game.board, color)
+    if null_move and not root and not in_check and depth >= NULL_MOVE_MIN_DEPTH and has_non_pawn_material(game, color):
+        null_info = do_null_move(game)
+        score = -alpha_beta(game, opp, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1, ply=ply + 1,
+                            null_move=False)[1]
+        undo_null_move(game, null_info)
+        if score >= beta:
+            return [None, beta]
 
-            new_game = make_move(game, move)
-            [_, score] = alpha_beta(new_game, opposing_color(color), depth - 1, alpha, beta)
+    # at the root, moves scoring equal to the best one are collected and one is
+    # picked at random; the window is widened by one so that such ties are exact
+    best_move = None
+    best_moves = []
+    if pv_move is None and entry:
+        pv_move = entry[3]
+    if depth == 1:
+        moves = staged_moves(game, moves, pv_move, color, ply)
+    else:
+        moves = order_moves(game, list(moves), pv_move, color, ply)
+
+    for move_count, move in enumerate(moves):
+        if verbose:
+            print('\t' * depth + str(depth) + '. evaluating ' + PIECE_CODES[
+                get_piece(game.board, move[0])] + move2str(move))
+
+        # late move reduction: late quiet moves are first searched one ply
+        # shallower with a null window, and again at full depth if they raise alpha
+        reduce = not root and not in_check and depth >= LMR_MIN_DEPTH and move_count >= LMR_FULL_DEPTH_MOVES and \
+                 not is_capture(game, move) and not is_promotion(game, move)
+        undo_info = do_move(game, move)
+        if reduce and not is_check(game.board, opp):
+            score = -alpha_beta(game, opp, depth - 2, -alpha - 1, -alpha, ply=ply + 1)[1]
+            if score > alpha:
+                score = -alpha_beta(game, opp, depth - 1, -beta, -alpha, ply=ply + 1)[1]
+        else:
+            score = -alpha_beta(game, opp, depth - 1, -beta, -alpha + 1 if root else -alpha, ply=ply + 1)[1]
+        undo_move(game, undo_info)
 
-            if verbose:
-                print('\t' * depth + str(depth) + '. ' + str(score) + ' [{},{}]'.format(alpha, beta))
+        if verbose:
+            print('\t' * depth + str(depth) + '. ' + str(score) + ' [{},{}]'.format(alpha, beta))
 
-            if score == win_score(opposing_color(color)):
-                return [move, score]
+        if score == MATE_SCORE:
+            if use_tt:
+                store_tt(key, depth, score, TT_EXACT, move)
+            return [move, score]
 
-            if score == beta:
-                best_moves.append(move)
-            if score < beta:  # black minimizes his score
-                beta = score
-                best_moves = [move]
-                if alpha > beta:  # alpha-beta cutoff
-                    if verbose:
-                        print('\t' * depth + 'cutoff')
-                    break
-        if best_moves:
-            return [choice(best_moves), beta]
+        if score > alpha:
+            alpha = score
+            best_move = move
+            best_moves = [move]
+            if alpha >= beta:  # alpha-beta cutoff
+                record_cutoff(game, move, color, depth, ply)
+                if verbose:
+                    print('\t' * depth + 'cutoff')
+                break
+        elif root and score == alpha:
+            best_moves.append(move)
+    if root and best_moves:
+        best_move = choice(best_moves)
+    if use_tt:
+        store_tt(key, depth, alpha, tt_flag(alpha, alpha_orig, beta_orig), best_move)
+    return [best_move, alpha]
+
+
+def iterative_deepening(game, color, depth, workers=1):
+    [move, score] = [None, None]
+    clear_move_ordering()
+    for d in range(1, depth + 1):
+        if workers > 1 and d == depth and d > 1:
+            [move, score] = parallel_alpha_beta(game, color, d, move, workers)
         else:
-            return [None, beta]
+            [move, score] = alpha_beta(game, color, d, pv_move=move, root=True)
+        if verbose:
+            print('depth {}: {} ({})'.format(d, move2str(move), score))
+    return [move, score]
+
+
+root_search_pool = None
+root_search_workers = 0
+root_search_id = 0
+worker_search_id = None
+
+# the pool is kept between moves, so that processes are only started once
+def get_root_search_pool(workers):
+    global root_search_pool, root_search_workers
+    if root_search_pool is None or root_search_workers != workers:
+        if root_search_pool is not None:
+            root_search_pool.shutdown()
+        root_search_pool = ProcessPoolExecutor(max_workers=workers)
+        root_search_workers = workers
+    return root_search_pool
+
+# runs in a worker process, which keeps its own transposition table and move
+# ordering tables between the root moves of one search and clears them when a
+# new search starts
+def search_root_move(game, move, depth, alpha, beta, search_id=None):
+    global worker_search_id
+    if search_id != worker_search_id:
+        transposition_table.clear()
+        clear_move_ordering()
+        worker_search_id = search_id
+    do_move(game, move)
+    return -alpha_beta(game, game.to_move, depth - 1, -beta, -alpha + 1, ply=1)[1]
+
+# the principal variation move is searched first to get a bound, then the other
+# root moves are split among worker processes
+def parallel_alpha_beta(game, color, depth, pv_move, workers):
+    global root_search_id
+    moves = cached_legal_moves(game, color)
+    if not moves or has_insufficient_material(game) or is_under_75_move_rule(game):
+        return [None, SIGN[color] * evaluate_end_node(game)]
+
+    moves = order_moves(game, list(moves), pv_move, color, 0)
+    undo_info = do_move(game, moves[0])
+    alpha = -alpha_beta(game, OPP[color], depth - 1, ply=1)[1]
+    undo_move(game, undo_info)
+    best_moves = [moves[0]]
+
+    if alpha != MATE_SCORE and len(moves) > 1:
+        root_search_id += 1
+        others = len(moves) - 1
+        scores = get_root_search_pool(workers).map(search_root_move, [game] * others, moves[1:], [depth] * others,
+                                                   [alpha] * others, [float('inf')] * others,
+                                                   [root_search_id] * others)
+        for move, score in zip(moves[1:], scores):
+            if score > alpha:
+                alpha = score
+                best_moves = [move]
+            elif score == alpha:
+                best_moves.append(move)
 
+    best_move = choice(best_moves)
+    if game.halfmove_clock + depth < HALFMOVE_CLOCK_LIMIT:
+        store_tt(game.zobrist, depth, alpha, TT_EXACT, best_move)
+    return [best_move, alpha]
 
-def get_AI_move(game, level, depth=2, use_book=False):
+def get_AI_move(game, level, depth=2, use_book=False, workers=1):
     if verbose:
         print('Searching best move for white...' if game.to_move == WHITE else 'Searching best move for black...')
     start_time = time()
+    game = deepcopy(game)  # the search makes and undoes moves in place
+    transposition_table.clear()
 
-    #if (use_book):
-     #   if find_in_book(game):
-      #      move = get_book_move(game)
-    #else:
-    if (level == 0):
+    if use_book and find_in_book(game):
+        move = get_book_move(game)
+    elif (level == 0):
         move = random_move(game, game.to_move)
     elif (level == 1):
-        move = minimax(game, game.to_move, depth)[0]
+        move = minimax(game, game.to_move, depth, root=True)[0]
     elif (level == 2):
-        move = alpha_beta(game, game.to_move, depth)[0]
+        move = iterative_deepening(game, game.to_move, depth, workers)[0]
     else:
         exit(0)
 
@@ -1459,25 +2015,29 @@ def watch_AI_game(level, game=Game(), sleep_seconds=0.5):
     print_outcome(game)
 
 
+# maps the moves played so far to the next move of every opening line that
+# starts with them, so that more common continuations are picked more often
+def load_book(file_name):
+    book = defaultdict(list)
+    with open(file_name) as book_file:
+        for line in book_file:
+            moves = line.split()
+            for i in range(len(moves)):
+                book[' '.join(moves[:i])].append(moves[i])
+    return dict(book)
+
+BOOK = load_book(path.join(path.dirname(path.abspath(__file__)), 'book.txt'))
+
+
 def find_in_book(game):
     if game.position_history[0] != INITIAL_FEN:
         return False
-
-    openings = []
-    book_file = open("book.txt")
-    for line in book_file:
-        if line.startswith(game.get_move_list()) and line.rstrip() > game.get_move_list():
-            openings.append(line.rstrip())
-    book_file.close()
-    return openings
+    return bool(BOOK.get(game.get_move_list()))
 
 
 def get_book_move(game):
-    openings = find_in_book(game)
-    chosen_opening = choice(openings)
-    next_moves = chosen_opening.replace(game.get_move_list(), '').lstrip()
-    move_str = next_moves.split(' ')[0]
-    move = [str2bb(move_str[:2]), str2bb(move_str[-2:])]
+    move_str = choice(BOOK[game.get_move_list()])
+    move = (str2bb(move_str[:2]), str2bb(move_str[-2:]))
     return move
 
 
@@ -7,16 +7,11 @@ from sys import stderr
 from time import strftime
 from copy import deepcopy
 
-pygame.init()
-
 SQUARE_SIDE = 50
 
-SCREEN = pygame.display.set_mode((8*SQUARE_SIDE, 8*SQUARE_SIDE), pygame.RESIZABLE)
+SCREEN = None
 SCREEN_TITLE = 'Chess Game'
 
-pygame.display.set_icon(pygame.image.load('images/chess_icon.ico'))
-pygame.display.set_caption(SCREEN_TITLE)
-
 level = 0
 is_menu = True
 
@@ -29,14 +24,21 @@ def start_the_game():
     global is_menu
     is_menu = False
 
-menu = pygame_menu.Menu(SQUARE_SIDE*8, SQUARE_SIDE*8, 'Set Difficulty', theme=pygame_menu.themes.THEME_GREEN)
-menu.add_selector('Difficulty : ', [('Easy', 0), ('Medium', 1), ('Hard', 2)],
-                      onchange=set_difficulty)
-menu.add_button('Play', start_the_game)
-menu.add_button('Quit', pygame_menu.events.EXIT)
+# opens the window, called from main.py so that the worker processes of the
+# hard AI, which import main.py again on some platforms, do not open one
+def init_screen():
+    global SCREEN
+    pygame.init()
+    SCREEN = pygame.display.set_mode((8*SQUARE_SIDE, 8*SQUARE_SIDE), pygame.RESIZABLE)
+    pygame.display.set_icon(pygame.image.load('images/chess_icon.ico'))
+    pygame.display.set_caption(SCREEN_TITLE)
 
 def display_menu():
-    global menu
+    menu = pygame_menu.Menu(SQUARE_SIDE*8, SQUARE_SIDE*8, 'Set Difficulty', theme=pygame_menu.themes.THEME_GREEN)
+    menu.add_selector('Difficulty : ', [('Easy', 0), ('Medium', 1), ('Hard', 2)],
+                          onchange=set_difficulty)
+    menu.add_button('Play', start_the_game)
+    menu.add_button('Quit', pygame_menu.events.EXIT)
 
     # waiting for user to set informations in menu
     while True:
@@ -54,11 +56,10 @@ def display_menu():
             break
 
         pygame.display.update()
-
-display_menu()
-print(level)
+    print(level)
 
 AI_SEARCH_DEPTH = 2
+AI_WORKERS = 1  # processes searching the root moves in parallel, 1 searches in this process only
 
 RED_CHECK          = (240, 150, 150)
 WHITE              = (255, 255, 255)
@@ -185,7 +186,7 @@ def set_title(title):
     
 def make_AI_move(game, color, level):
     set_title(SCREEN_TITLE + ' - Calculating move...')
-    new_game = chess.make_move(game, chess.get_AI_move(game, level, AI_SEARCH_DEPTH))
+    new_game = chess.make_move(game, chess.get_AI_move(game, level, AI_SEARCH_DEPTH, workers=AI_WORKERS))
     set_title(SCREEN_TITLE)
     print_board(new_game.board, color)
     return new_game
@@ -259,6 +260,7 @@ def play_as(game, color, level):
                         if joker == 13 and chess.get_queen(game.board, color):
                             queen_index = chess.bb2index(chess.get_queen(game.board, color))
                             game.board[queen_index] = color|chess.JOKER
+                            game.reset_incremental_state()
                             print_board(game.board, color)
                 
                 if event.type == pygame.VIDEORESIZE:
@@ -1,4 +1,6 @@
 import gui
 
 if __name__ == "__main__":
+    gui.init_screen()
+    gui.display_menu()
     gui.play_random_color()